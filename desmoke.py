@@ -1,88 +1,130 @@
 #!/usr/bin/env python3
-from abc import ABC, abstractmethod
-import argparse
 from dataclasses import dataclass
 from io import TextIOBase
+import itertools
 import json
+import mmap
 import re
+import stat
 import sys
 import os
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Callable, ClassVar, Iterator, List, Optional, Tuple, Union
 
 
-Json = Dict[str, Any]
+# A buffer of whole input lines, see read_blocks().
+Block = Union[bytes, mmap.mmap]
 
 
-def diff(a, b) -> Tuple[Any, Any]:
+def nested_diff(a, b, stack: Optional[List[Tuple[Any, Any, Any, Any]]]) -> Tuple[Any, Any]:
     """
-    Return the deep diff between two elements, or None if they are equal.
+    Get the diff of two unequal elements. Elements of different types or scalars are
+    their own diff. For containers of the same type, empty diff containers are returned
+    right away, and the work of filling them in is pushed onto the stack.
     """
-    if a == b:
-        return None
+    if type(a) != type(b) or not isinstance(a, (dict, list, tuple)):
+        return a, b
+
+    diff_a: Any
+    diff_b: Any
+    diff_a, diff_b = (dict(), dict()) if isinstance(a, dict) else (list(), list())
+    if stack is None:
+        container_diff([(a, b, diff_a, diff_b)])
+    else:
+        stack.append((a, b, diff_a, diff_b))
+    return diff_a, diff_b
 
-    if type(a) != type(b):
-        return (a, b)
 
-    if isinstance(a, dict):
-        return dict_diff(a, b)
+def container_diff(stack: List[Tuple[Any, Any, Any, Any]]):
+    """
+    Fill in the deep diffs of dicts and lists. The stack holds (a, b, diff_a, diff_b) entries
+    and is walked iteratively, so that deeply nested objects don't need a Python frame per level.
+    Nested diffs are placed in their parent as soon as the parent is visited, so they keep
+    the parent's order even though they are filled in later.
+    """
+    while stack:
+        a, b, diff_a, diff_b = stack.pop()
+
+        if isinstance(a, dict):
+            both = a.keys() & b.keys()
+            for k in a.keys() - both:
+                diff_a[k] = a[k]
+            for k in b.keys() - both:
+                diff_b[k] = b[k]
+
+            for k in both:
+                va, vb = a[k], b[k]
+                if va is not vb and va != vb:
+                    diff_a[k], diff_b[k] = nested_diff(va, vb, stack)
+            continue
 
-    if isinstance(a, (list, tuple)):
-        return list_diff(a, b)
+        for (va, vb) in zip(a, b):
+            if va is not vb and va != vb:
+                result = nested_diff(va, vb, stack)
+                diff_a.append(result[0])
+                diff_b.append(result[1])
 
-    return a, b
+        if len(a) < len(b):
+            diff_b.extend(b[len(a) :])
+        elif len(a) > len(b):
+            diff_a.extend(a[len(b) :])
 
 
-def list_diff(a: List[Any], b: List[Any]) -> Tuple[List[Any], List[Any]]:
-    """
-    Get the deep diff of two lists.
-    """
-    diff_a = list()
-    diff_b = list()
+def decode(raw: bytes) -> str:
+    return raw.decode("utf-8", "replace")
 
-    for (va, vb) in zip(a, b):
-        result = diff(va, vb)
-        if result is not None:
-            diff_a.append(result[0])
-            diff_b.append(result[1])
 
-    if len(a) != len(b):
-        shorter_len = min(len(a), len(b))
-        longer_len = max(len(a), len(b))
-        if shorter_len == len(a):
-            diff_b.extend(b[shorter_len:longer_len])
-        else:
-            diff_a.extend(a[shorter_len:longer_len])
+# Traceback frames are either "<function>@<file>:<line>:<column>" or "<file>:<line>:<column>".
+# File paths can't contain "@", so checking for it picks the only pattern that can match,
+# instead of making the regex engine try (and back out of) an optional function prefix.
+FILE_TRACE_WITH_AT_PATTERN = re.compile(r"^[\w\.]*@(?P<file>[\w\.\/]+):(?P<line>\d+):(?P<column>\d+)$")
+FILE_TRACE_PLAIN_PATTERN = re.compile(r"^(?P<file>[\w\.\/]+):(?P<line>\d+):(?P<column>\d+)$")
 
-    return diff_a, diff_b
+
+def match_traceback(contents: str):
+    if "@" in contents:
+        return FILE_TRACE_WITH_AT_PATTERN.match(contents)
+    return FILE_TRACE_PLAIN_PATTERN.match(contents)
 
 
-def dict_diff(a: Json, b: Json) -> Tuple[Json, Json]:
+def traceback_frame(contents: bytes) -> Optional[str]:
     """
-    Get the deep diff of two dictionaries.
+    Return the decoded line if it is a traceback frame, or None otherwise. Every frame ends in
+    ":<line>:<column>", so most other lines can be rejected by their last character without
+    decoding them or running the regex. A trailing carriage return from CRLF logs is ignored.
     """
-    diff_a = dict()
-    diff_b = dict()
-
-    if not (isinstance(a, dict) and isinstance(b, dict)):
-        return (a, b)
-
-    both = set(a.keys()).intersection(set(b.keys()))
-    only_a = set(a.keys()).difference(both)
-    only_b = set(b.keys()).difference(both)
+    if contents.endswith(b"\r"):
+        contents = contents[:-1]
+    if not contents[-1:].isdigit():
+        return None
+    frame = decode(contents)
+    if match_traceback(frame) is None:
+        return None
+    return frame
 
-    for k in only_a:
-        diff_a[k] = a[k]
-    for k in only_b:
-        diff_b[k] = b[k]
 
-    for k in both:
-        result = diff(a[k], b[k])
-        if result is not None:
-            diff_a[k], diff_b[k] = result
-    return (diff_a, diff_b)
+JSON_CONSTANTS = {"true": True, "false": False, "null": None}
 
 
-FILE_TRACE_PATTERN = re.compile(r"^([\w\.]*@)?([\w\.\/]+):(\d+):(\d+)$")
+def parse_operand(s: str) -> Any:
+    """
+    Parse one side of a failed equality assertion, or return an empty object if it isn't valid JSON.
+    Most operands are small integers, strings or constants, which are handled without the JSON parser
+    as long as the result is exactly what json.loads() would return.
+    """
+    digits = s[1:] if s[0] == "-" else s
+    if digits.isascii() and digits.isdigit() and (digits[0] != "0" or len(digits) == 1):
+        return int(s)
+    if len(s) >= 2 and s[0] == '"' and s[-1] == '"':
+        inner = s[1:-1]
+        if '"' not in inner and "\\" not in inner and inner.isprintable():
+            return inner
+    if s in JSON_CONSTANTS:
+        return JSON_CONSTANTS[s]
+
+    try:
+        return json.loads(s)
+    except json.decoder.JSONDecodeError:
+        return dict()
 
 
 @dataclass
@@ -91,6 +133,8 @@ class Position:
     A position in a file.
     """
 
+    __slots__ = ("file", "line", "column")
+
     file: str
     line: str
     column: str
@@ -102,11 +146,12 @@ class Position:
         the jstests/ directory.
         """
         for trace in traces:
-            match = FILE_TRACE_PATTERN.match(trace)
+            match = match_traceback(trace)
             if match is None:
                 raise ValueError("string did not match traceback.")
-            if match.group(2).startswith("jstests") or match.group(2).startswith("src/mongo/db/modules/enterprise/jstests"):
-                return cls(match.group(2), match.group(3), match.group(4))
+            file = match.group("file")
+            if file.startswith("jstests") or file.startswith("src/mongo/db/modules/enterprise/jstests"):
+                return cls(file, match.group("line"), match.group("column"))
         return None
 
     def __str__(self) -> str:
@@ -119,14 +164,19 @@ class Assertion:
     A generic assertion.
     """
 
-    PATTERN = re.compile(f"Error: (.*)?:$")
+    PATTERN: ClassVar[re.Pattern] = re.compile(r"^\s*Error:\s*(?P<message>.*?):\s*$")
+
+    # Assertions are collected for the whole run, so avoid a __dict__ per instance.
+    # Subclasses only declare the slots for the fields they add. The compiled build leaves
+    # these out, see setup.py.
+    __slots__ = ("position", "message")
 
     position: Position
-    message: Union[str, Json]
+    message: Any
 
     @classmethod
     def do_parse(cls, match, pos):
-        msg = match.group(1)
+        msg = match.group("message")
         if msg is None:
             msg = "<no message>"
         return cls(pos, msg)
@@ -137,7 +187,7 @@ class Assertion:
         Parse an assertion from a string which represents it, and return None
         if the string doesn't match.
         """
-        if match := cls.PATTERN.search(assertion):
+        if match := cls.PATTERN.match(assertion):
             return cls.do_parse(match, pos)
 
     def __str__(self) -> str:
@@ -146,13 +196,15 @@ class Assertion:
 
 @dataclass
 class JSError(Assertion):
-    PATTERN = re.compile(f"(\w+Error): (.*) :")
+    PATTERN: ClassVar[re.Pattern] = re.compile(r"^\s*(?P<error_type>\w+Error): (?P<error_message>.*) :")
+
+    __slots__ = ("error_type",)
 
     error_type: str
 
     @classmethod
     def do_parse(cls, match, pos):
-        return cls(pos, match.group(2), match.group(1))
+        return cls(pos, match.group("error_message"), match.group("error_type"))
 
     def __str__(self) -> str:
         return f"{self.position}: warning: {self.error_type}: {self.message}"
@@ -164,169 +216,88 @@ class Inequality(Assertion):
     A failing equality assertion.
     """
 
-    PATTERN = re.compile(r"Error: (.+) != (.+) are not equal (:.*)?:")
+    PATTERN: ClassVar[re.Pattern] = re.compile(
+        r"^\s*Error: (?P<left>.+) != (?P<right>.+) are not equal (?P<ineq_message>:.*)?:"
+    )
+
+    __slots__ = ("left", "right", "_cached_str")
+
+    left: Any
+    right: Any
 
-    left: Json
-    right: Json
+    def __post_init__(self) -> None:
+        # Formatting dumps both operands and their diff, and assertions are printed again in
+        # the summary, so only do it once. This is a plain attribute rather than a field, so that
+        # it's left out of __init__, __repr__ and __eq__.
+        self._cached_str: Optional[str] = None
 
     @classmethod
     def do_parse(cls, match, pos):
-        try:
-            left = json.loads(match.group(1))
-        except json.decoder.JSONDecodeError:
-            left = dict()
-        try:
-            right = json.loads(match.group(2))
-        except json.decoder.JSONDecodeError:
-            right = dict()
-            
-        if match.group(3) is not None:
+        left = parse_operand(match.group("left"))
+        right = parse_operand(match.group("right"))
+
+        if (raw_msg := match.group("ineq_message")) is not None:
             try:
-                msg = json.loads(match.group(3)[1:])
+                msg = json.loads(raw_msg[1:])
             except json.decoder.JSONDecodeError:
-                msg = match.group(3)[1:]
+                msg = raw_msg[1:]
         else:
             msg = "<no message>"
         return cls(pos, msg, left, right)
 
     def __str__(self) -> str:
-        left_diff, right_diff = diff(self.left, self.right)
-        return f"{self.position}: error: assert equals failed: {self.message}: {json.dumps(self.left)} != {json.dumps(self.right)}\nDiff:\nLeft:{json.dumps(left_diff)}\nRight:{json.dumps(right_diff)}"
-
-
-LINE_PATTERN = re.compile(r"^\[([\w:]+)\] (.+)$")
-
-
-class BaseState(ABC):
-    """
-    The resmoke log parser is defined as a finite state machine. Each state implements a process()
-    method which takes in the relevant part of the log line, extracts relevant information
-    from that line, and optionally transitions to a new state.
-    """
-
-    @abstractmethod
-    def process(self, contents: str):
-        pass
-
-    def process_contents(self, contents):
-        """
-        If the process() function returns None, that means that the machine did not transition to a
-        new state and self should be returned to the caller.
-        """
-        res = self.process(contents)
-        if res is None:
-            return self
+        if self._cached_str is not None:
+            return self._cached_str
+        left = json.dumps(self.left)
+        right = json.dumps(self.right)
+        # Only containers of the same type have a diff smaller than the operands themselves,
+        # otherwise reuse the strings that were just dumped.
+        if type(self.left) != type(self.right) or not isinstance(self.left, (dict, list, tuple)):
+            left_diff, right_diff = left, right
         else:
-            return res
-
-    def step(self, line: str):
-        """
-        Process a single log line. This function does some pre-processing, removing the status column and
-        filtering out mongod log lines from processing.
-        """
-        match = LINE_PATTERN.match(line)
-        if match is None or not match.group(1).startswith("js_test"):
-            return self
-
-        contents = match.group(2)
-        return self.process_contents(contents)
-
-    def is_complete(self) -> bool:
-        """
-        Returns True if get() will return a fully parsed assertion.
-        """
-        return False
-
-    def get():
-        """
-        Get the fully parsed assertion from the parser.
-        """
-        raise RuntimeError("Cannot get() on a non-complete parser.")
-
+            left_diff, right_diff = map(json.dumps, nested_diff(self.left, self.right, None))
+        self._cached_str = f"{self.position}: error: assert equals failed: {self.message}: {left} != {right}\nDiff:\nLeft:{left_diff}\nRight:{right_diff}"
+        return self._cached_str
 
-ASSERTION_START = "uncaught exception:"
 
+# All assertion patterns combined into a single regex, so that an assertion string only needs
+# to be scanned once. Alternatives are tried in priority order at the same anchored position,
+# and the name of the outermost group that matched selects the class to build.
+ASSERTION_DISPATCH = re.compile(
+    r"^\s*(?:"
+    r"(?P<Inequality>Error: (?P<left>.+) != (?P<right>.+) are not equal (?P<ineq_message>:.*)?:)"
+    r"|(?P<JSError>(?P<error_type>\w+Error): (?P<error_message>.*) :)"
+    r"|(?P<Assertion>Error:\s*(?P<message>.*?):\s*$)"
+    r")"
+)
+ASSERTION_CLASSES = {cls.__name__: cls for cls in (Inequality, JSError, Assertion)}
 
-class StartState(BaseState):
-    """
-    Don't collect any lines until we find the start of an assertion.
-    """
 
-    def process(self, contents: str):
-        # TRANSITION: Beginning of assertion.
-        if contents.startswith(ASSERTION_START):
-            return AssertionState(contents)
+ASSERTION_START = b"uncaught exception:"
+ASSERTION_START_LEN = len(ASSERTION_START)
 
 
-class AssertionState(BaseState):
+def parse_assertion(raw_assertion: str, raw_traceback: List[str]) -> Assertion:
     """
-    Collect all lines that make up the assertion message.
-    The shell's tojson() method pretty-prints objects, and so many
-    assertion messages take up multiple lines.
+    Build an assertion from its message, already joined into one string, and its traceback lines.
     """
-
-    def __init__(self, first_line):
-        self.lines = [first_line[len(ASSERTION_START) :]]
-
-    def process(self, contents: str):
-        # TRANSITION: We've found all the lines from the assertion output, now it's time to collect the traceback.
-        if FILE_TRACE_PATTERN.match(contents) is not None:
-            return TracebackState(self.lines, contents)
-
-        # Remove any indentation at the beginning of the line.
-        self.lines.append(contents.strip())
-
-
-class TracebackState(BaseState):
-    def __init__(self, assertion_lines, first_traceback):
-        self.assertion_lines = assertion_lines
-        self.traceback_lines = [first_traceback]
-
-    def process(self, contents: str):
-        # TRANSITION: when the next line isn't a traceback, we've got all our information.
-        if FILE_TRACE_PATTERN.match(contents) is None:
-            return CompleteState(
-                "".join(self.assertion_lines), self.traceback_lines, contents
-            )
-        self.traceback_lines.append(contents)
-
-
-class CompleteState(BaseState):
-    def __init__(
-        self, raw_assertion: str, raw_traceback: List[str], next_contents: str
-    ):
-        self.raw_assertion = raw_assertion
-        self.raw_traceback = raw_traceback
-        self.next_contents = next_contents
-
-    def is_complete(self) -> bool:
-        return True
-
-    def get(self):
-        pos = Position.from_traceback(self.raw_traceback)
-        assertion_string = "".join(self.raw_assertion)
-        assert_order = [Inequality, JSError, Assertion]
-        for assert_class in assert_order:
-            if assert_obj := assert_class.parse(assertion_string, pos):
-                return assert_obj
-        raise RuntimeError(
-            f"Assertion did not match any existing patterns: {assertion_string}"
-        )
-
-    def process(self, contents: str):
-        """
-        Calling process() on a complete state will need to process the stored next line as
-        well as the passed in line. Make sure to call get() before process() to collect the assertion.
-        """
-        return (
-            StartState().process_contents(self.next_contents).process_contents(contents)
-        )
+    pos = Position.from_traceback(raw_traceback)
+    match = ASSERTION_DISPATCH.match(raw_assertion)
+    if match is not None and match.lastgroup is not None:
+        return ASSERTION_CLASSES[match.lastgroup].do_parse(match, pos)
+    raise RuntimeError(
+        f"Assertion did not match any existing patterns: {raw_assertion}"
+    )
 
 
 def install_task(filename):
     if filename is None:
         filename = ".vscode/tasks.json"
 
+    # The tasks run this script. When the compiled module is in use, __file__ is the path of the
+    # extension module, which can't be executed, so take the path of the script that was run.
+    script = os.path.realpath(sys.argv[0])
+
     jstest_task = {
         "label": "Desmoke: Run file as jstest",
         "type": "shell",
@@ -334,7 +305,7 @@ def install_task(filename):
         "args": [
             "-c",
             "source python3-venv/bin/activate && ./buildscripts/resmoke.py run ${relativeFile} | "
-            + f"{__file__} --tool resmoke",
+            + f"{script} --tool resmoke",
         ],
         "group": {"kind": "test", "isDefault": True},
         "presentation": {"focus": True, "clear": True},
@@ -359,7 +330,7 @@ def install_task(filename):
         "args": [
             "-c",
             "source python3-venv/bin/activate && ninja -j400 +${fileBasenameNoExtension} | "
-            + f"{__file__} --tool scons",
+            + f"{script} --tool scons",
         ],
         "group": "test",
         "presentation": {"focus": True, "clear": True},
@@ -414,98 +385,360 @@ def desmoke_print(s, pass_through):
         print(s)
 
 
-def process_resmoke(file, pass_through):
-    parser = StartState()
+READ_SIZE = 1 << 20
+
+
+def read_blocks(filename: Optional[str]) -> Iterator[Block]:
+    """
+    Yield the raw input as buffers made up of whole lines, reading from stdin if no filename is given.
+    Regular files are memory-mapped and yielded as a single buffer, so that multi-gigabyte logs are
+    paged in by the OS and can be scanned by the regex engine without copying them. Streams are read
+    in large chunks rather than line by line, so splitting lines also happens in C.
+    """
+    if filename is None:
+        file = open(sys.stdin.fileno(), "rb")
+    else:
+        file = open(filename, "rb")
+
+    with file:
+        info = os.fstat(file.fileno())
+        # mmap can't map empty files or streams like pipes.
+        if filename is not None and stat.S_ISREG(info.st_mode) and info.st_size > 0:
+            # The map isn't closed explicitly, since slices and matches over it may still be alive.
+            yield mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return
+
+        # read1() returns whatever is available instead of waiting for a full chunk, so each block
+        # is yielded as soon as a running test has written it, and the parsers flush their output
+        # after every block (see PassThrough.end_block()). A partial last line is held back until
+        # the rest of it arrives.
+        tail = b""
+        while chunk := file.read1(READ_SIZE):
+            end = chunk.rfind(b"\n") + 1
+            if end == 0:
+                tail += chunk
+                continue
+            yield tail + chunk[:end]
+            tail = chunk[end:]
+        if tail:
+            yield tail
+
+
+def split_lines(block: Block) -> Iterator[bytes]:
+    """
+    Yield each line of a block returned by read_blocks(), including its newline.
+    """
+    pos = 0
+    size = len(block)
+    while pos < size:
+        eol = block.find(b"\n", pos)
+        end = size if eol < 0 else eol + 1
+        yield block[pos:end]
+        pos = end
+
+
+class PassThrough:
+    """
+    Forwards raw input lines to stdout. Lines are buffered and written in batches, and
+    flush() must be called before any desmoke output so that it still appears right after
+    the line that triggered it. end_block() must be called after each input block, so that
+    piped input streams through instead of waiting for a full batch.
+    """
+
+    BATCH_SIZE: ClassVar[int] = 4096
+    REGION_SIZE: ClassVar[int] = 1 << 20
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, raw: bytes):
+        self.lines.append(raw)
+        if len(self.lines) >= self.BATCH_SIZE:
+            self.flush()
+
+    def write_region(self, block: Block, start: int, end: int):
+        """
+        Forward block[start:end]. Large regions are written in pieces, so that skipping over
+        most of a memory-mapped file doesn't copy all of it into memory at once.
+        """
+        if end - start < self.REGION_SIZE:
+            if end > start:
+                self.write(block[start:end])
+            return
+        self.flush()
+        for piece_start in range(start, end, self.REGION_SIZE):
+            sys.stdout.buffer.write(block[piece_start : min(piece_start + self.REGION_SIZE, end)])
+
+    def flush(self):
+        if not self.lines:
+            return
+        # Anything print()ed so far is still sitting in the text layer, so flush it first.
+        sys.stdout.flush()
+        sys.stdout.buffer.write(b"".join(self.lines))
+        self.lines.clear()
+
+    def end_block(self):
+        """
+        Write out everything forwarded or printed so far. A memory-mapped file is a single block,
+        so this only flushes once at the end, while streams are flushed as each chunk is read.
+        """
+        self.flush()
+        # Flushing the text layer flushes the underlying binary buffer as well.
+        sys.stdout.flush()
+
+
+# Modes of the resmoke log parser.
+START, ASSERT, TRACEBACK = range(3)
+
+# A js_test line that starts an assertion, i.e. one that would move the parser out of START.
+# The tag runs up to the first "] ", the same way the parser splits lines.
+ASSERTION_START_LINE = re.compile(
+    rb"^\[js_test(?:[^\]\n]|\](?! ))*\] uncaught exception:", re.MULTILINE
+)
+
+
+def process_resmoke(blocks: Iterator[Block], pass_through: bool) -> List[Assertion]:
+    """
+    The resmoke log parser is a finite state machine over the js_test lines of the log:
+      START:     Don't collect any lines until we find the start of an assertion.
+      ASSERT:    Collect all lines that make up the assertion message. The shell's tojson()
+                 method pretty-prints objects, and so many assertion messages take up multiple lines.
+      TRACEBACK: Collect the traceback, until a line that isn't part of it completes the assertion.
+    The machine is kept in local variables rather than state objects, since the work done per line
+    is small enough that method dispatch would dominate. Most of a log is spent in START, so
+    that stretch is skipped with a single regex search instead of looking at each line in Python.
+    """
+    mode = START
+    assertion_lines = []
+    traceback_lines = []
     assertions = []
-    while line := file.readline():
-        if pass_through:
-            sys.stdout.write(line)
-        parser = parser.step(line)
-        if parser.is_complete():
-            assertion = parser.get()
-            desmoke_print(assertion, pass_through)
-            assertions.append(assertion)
-
-    file.close()
+    out = PassThrough()
+    for block in blocks:
+        pos = 0
+        size = len(block)
+        while pos < size:
+            if mode == START:
+                match = ASSERTION_START_LINE.search(block, pos)
+                start = size if match is None else match.start()
+                if pass_through:
+                    out.write_region(block, pos, start)
+                if match is None:
+                    break
+                pos = start
+
+            eol = block.find(b"\n", pos)
+            end = size if eol < 0 else eol + 1
+            raw = block[pos:end]
+            pos = end
+            if pass_through:
+                out.write(raw)
+            # Only "[tag] ..." lines are relevant to the parser.
+            if not raw.startswith(b"["):
+                continue
+
+            # Filter out mongod log lines by their tag in place, before looking for the end of the
+            # tag, then split on the first "] " rather than using a regex. Lines stay as bytes, and
+            # are only decoded once they're known to be part of an assertion.
+            if not raw.startswith(b"js_test", 1):
+                continue
+            tag_end = raw.find(b"] ", 1)
+            if tag_end < 0:
+                continue
+            contents = raw[tag_end + 2 :].rstrip(b"\r\n")
+            if not contents:
+                continue
+
+            if mode == ASSERT:
+                # TRANSITION: We've found all the lines from the assertion output, now it's time to collect the traceback.
+                if (frame := traceback_frame(contents)) is not None:
+                    mode = TRACEBACK
+                    traceback_lines = [frame]
+                else:
+                    # Remove any indentation at the beginning of the line.
+                    assertion_lines.append(contents.strip())
+                continue
+
+            if mode == TRACEBACK:
+                if (frame := traceback_frame(contents)) is not None:
+                    traceback_lines.append(frame)
+                    continue
+                # TRANSITION: when the next line isn't a traceback, we've got all our information.
+                # The current line still needs to be processed from the start mode.
+                assertion = parse_assertion(decode(b"".join(assertion_lines)), traceback_lines)
+                out.flush()
+                desmoke_print(assertion, pass_through)
+                assertions.append(assertion)
+                mode = START
+
+            # TRANSITION: Beginning of assertion.
+            if contents.startswith(ASSERTION_START):
+                mode = ASSERT
+                assertion_lines = [contents[ASSERTION_START_LEN:]]
+
+        out.end_block()
+
     return assertions
 
 
-def process_unittest(file, pass_through):
+# The location comes last, so the message is matched lazily up to the whitespace before the
+# "@" instead of running to the end of the error and backtracking.
+UNITTEST_ERROR_PATTERN = re.compile(r"^(.*?)\s+@([\w\.\/]+):(\d+)$")
+
+
+def process_unittest(blocks: Iterator[Block], pass_through: bool) -> List[str]:
     """
     Luckily, each line in C++ unit test output is a JSON object, so parsing
     is much easier! Still need to do some string manipulation to get it in an unambiguous format
     for desmoke to output.
     """
-    UNITTEST_ERROR_PATTERN = re.compile(r"^(.*)\s+@([\w\.\/]+):(\d+)$")
+    # orjson is much faster at parsing unit test logs, but desmoke doesn't require it.
+    # It's imported here so that resmoke logs don't pay for the import.
+    json_loads: Callable[[bytes], Any]
+    try:
+        import orjson
+        json_loads = orjson.loads
+    except ImportError:
+        json_loads = json.loads
 
     assertions = []
-    while line := file.readline():
-        if pass_through:
-            sys.stdout.write(line)
-        try:
-            log = json.loads(line)
-        except json.decoder.JSONDecodeError:
-            continue
-        
-        # The JSON parser picks up valid JSON elements, so make sure we have a full object before parsing.
-        if not isinstance(log, dict):
-            continue
-
-        # Look for log lines that represent test failures, then parse and reformat the error message.
-        if log.get("c") == "TEST" and log.get("msg") == "FAIL":
-            if match := UNITTEST_ERROR_PATTERN.match(log.get("attr", dict()).get("error", "")):
+    out = PassThrough()
+    for block in blocks:
+        for line in split_lines(block):
+            if pass_through:
+                out.write(line)
+
+            # Only full JSON objects are log lines, so skip anything else without invoking the parser.
+            # json.loads() accepts leading whitespace, so indented objects are still parsed.
+            if not line.lstrip().startswith(b"{"):
+                continue
+            try:
+                log = json_loads(line)
+            except ValueError:
+                # Both parsers raise subclasses of ValueError, for invalid JSON as well as for
+                # invalid UTF-8, which json.loads() reports as a UnicodeDecodeError.
+                continue
+
+            # Look for log lines that represent test failures, then parse and reformat the error message.
+            if log.get("c") != "TEST" or log.get("msg") != "FAIL":
+                continue
+            attr = log.get("attr")
+            error = attr.get("error") if attr else None
+            if not error or "@" not in error:
+                continue
+            if match := UNITTEST_ERROR_PATTERN.match(error):
                 assertion = f"{match.group(2)}:{match.group(3)}: {match.group(1)}"
+                out.flush()
                 desmoke_print(assertion, pass_through)
                 assertions.append(assertion)
-    file.close()
+
+        out.end_block()
+
     return assertions
 
 
-def setup_parser():
-    parser = argparse.ArgumentParser(description="Prettify resmoke output.")
-    parser.add_argument(
-        "filename",
-        nargs="?",
-        help="Target file. In log-parsing mode, used as input if provided, defaults to stdin. In install mode, used as output for tasks.json. Defaults to ./.vscode/tasks.json.",
-    )
-    main_group = parser.add_argument_group("Process Test Log")
-    group = main_group.add_mutually_exclusive_group()
-    group.add_argument(
-        "--summary",
-        action="store_true",
-        help="Report a summary at the end of the output.",
-    )
-    group.add_argument(
-        "--only",
-        action="store_true",
-        help="Only send desmoke.py output to stdout without forwarding the input file or stream.",
-    )
-    main_group.add_argument(
-        "--tool",
-        choices=["resmoke", "scons"],
-        help="Force a certain log parser. By default, desmoke.py will make a best guess based on the first log line.",
-    )
-    install_group = parser.add_argument_group("Install Tasks for VSCode")
+# The usage and help text are written by hand, laid out the way argparse printed them on
+# Python 3.9, the version desmoke supports. {prog} is filled in by program_name().
+USAGE = "usage: {prog} [-h] [--summary | --only] [--tool {{resmoke,scons}}] [--install] [filename]"
 
-    install_group.add_argument(
-        "--install",
-        action="store_true",
-        help="Adds tasks to vscode's tasks.json to enable VSCode integration. Defaults to .vscode/tasks.json if no filename is provided.",
-    )
-    return parser
+HELP = USAGE + """
+
+Prettify resmoke output.
+
+positional arguments:
+  filename              Target file. In log-parsing mode, used as input if
+                        provided, defaults to stdin. In install mode, used as
+                        output for tasks.json. Defaults to
+                        ./.vscode/tasks.json.
+
+optional arguments:
+  -h, --help            show this help message and exit
+
+Process Test Log:
+  --summary             Report a summary at the end of the output.
+  --only                Only send desmoke.py output to stdout without
+                        forwarding the input file or stream.
+  --tool {{resmoke,scons}}
+                        Force a certain log parser. By default, desmoke.py
+                        will make a best guess based on the first log line.
+
+Install Tasks for VSCode:
+  --install             Adds tasks to vscode's tasks.json to enable VSCode
+                        integration. Defaults to .vscode/tasks.json if no
+                        filename is provided."""
+
+TOOLS = ("resmoke", "scons")
+
+
+@dataclass
+class Args:
+    filename: Optional[str] = None
+    summary: bool = False
+    only: bool = False
+    tool: Optional[str] = None
+    install: bool = False
+
+
+def program_name() -> str:
+    """
+    Name the program after the script that was run, like argparse does, since it may be
+    run through a symlink or under another name on the PATH.
+    """
+    return os.path.basename(sys.argv[0])
+
+
+def usage_error(message: str):
+    prog = program_name()
+    print(f"{USAGE.format(prog=prog)}\n{prog}: error: {message}", file=sys.stderr)
+    exit(2)
+
+
+def parse_args(argv: List[str]) -> Args:
+    """
+    desmoke is usually run on short logs, where importing argparse takes a noticeable
+    part of the total runtime, so the handful of supported options are parsed by hand.
+    """
+    args = Args()
+    rest = iter(argv)
+    only_positionals = False
+    for arg in rest:
+        if only_positionals or arg == "-" or not arg.startswith("-"):
+            if args.filename is not None:
+                usage_error(f"unrecognized arguments: {arg}")
+            args.filename = arg
+        elif arg == "--":
+            only_positionals = True
+        elif arg in ("-h", "--help"):
+            print(HELP.format(prog=program_name()))
+            exit(0)
+        elif arg == "--summary":
+            if args.only:
+                usage_error("argument --summary: not allowed with argument --only")
+            args.summary = True
+        elif arg == "--only":
+            if args.summary:
+                usage_error("argument --only: not allowed with argument --summary")
+            args.only = True
+        elif arg == "--install":
+            args.install = True
+        elif arg == "--tool" or arg.startswith("--tool="):
+            tool = arg[len("--tool=") :] if "=" in arg else next(rest, None)
+            if tool is None:
+                usage_error("argument --tool: expected one argument")
+            if tool not in TOOLS:
+                usage_error(f"argument --tool: invalid choice: '{tool}' (choose from 'resmoke', 'scons')")
+            args.tool = tool
+        else:
+            usage_error(f"unrecognized arguments: {arg}")
+    return args
 
 
 def main():
-    argparser = setup_parser()
-    args = argparser.parse_args()
+    args = parse_args(sys.argv[1:])
     if args.install:
         return install_task(args.filename)
 
     # Read from stdin (likely piped output) if a file wasn't specified.
-    if args.filename is None:
-        file = open(sys.stdin.fileno(), "r")
-    else:
-        file = open(args.filename, "r")
+    blocks = read_blocks(args.filename)
 
     pass_through = not args.only
     summary = args.summary
@@ -513,19 +746,18 @@ def main():
     # Infer filetype from the first line of the file.
     mode = args.tool
     if mode is None:
-        first_line = file.readline()
-        if first_line.startswith("[resmoke]"):
+        first_block = next(blocks, b"")
+        # mmap objects don't have startswith(), so compare a slice instead.
+        if first_block[: len(b"[resmoke]")] == b"[resmoke]":
             mode = "resmoke"
         else:
             mode = "scons"
+        blocks = itertools.chain([first_block], blocks)
 
     if mode == "resmoke":
-        assertions = process_resmoke(file, pass_through)
-    elif mode == "scons":
-        assertions = process_unittest(file, pass_through)
+        assertions = process_resmoke(blocks, pass_through)
     else:
-        argparser.print_help()
-        return
+        assertions = process_unittest(blocks, pass_through)
 
     if summary:
         print("----")
@@ -535,5 +767,31 @@ def main():
     exit(0 if len(assertions) == 0 else 1)
 
 
+def compiled_module_is_current() -> bool:
+    """
+    Check for a mypyc-compiled desmoke module next to this script, see setup.py. This is checked
+    explicitly, since importing desmoke when it hasn't been built would load this file a second time.
+    A module built before the last change to this file, e.g. by a git pull, is ignored rather than
+    running outdated code.
+    """
+    from importlib.machinery import EXTENSION_SUFFIXES
+
+    source = os.path.realpath(__file__)
+    directory = os.path.dirname(source)
+    source_mtime = os.path.getmtime(source)
+    for suffix in EXTENSION_SUFFIXES:
+        module = os.path.join(directory, f"desmoke{suffix}")
+        if os.path.exists(module):
+            return os.path.getmtime(module) >= source_mtime
+    return False
+
+
 if __name__ == "__main__":
-    main()
+    if compiled_module_is_current():
+        # The script's directory is first on sys.path, and extension modules take precedence
+        # over source files, so this imports the compiled module.
+        from importlib import import_module
+
+        import_module("desmoke").main()
+    else:
+        main()
@@ -0,0 +1,35 @@
+"""
+Optionally compile desmoke.py with mypyc, which speeds up parsing large logs:
+
+    pip install mypy
+    python setup.py build_ext --inplace
+
+This builds an extension module next to desmoke.py, which the script runs instead of itself
+as long as the module is newer than desmoke.py. Rebuild it after pulling or editing desmoke.py,
+and delete it to go back to plain Python.
+"""
+import os
+import re
+
+from setuptools import setup
+from mypyc.build import mypycify
+
+# The assertion dataclasses declare __slots__ for plain Python, but mypyc records __slots__ in the
+# class annotations, where dataclass() takes it for a field with a default. Compiled classes have
+# a fixed attribute layout anyway, so a copy of the script without the slots is compiled instead.
+SLOTS_LINE = re.compile(r"^    __slots__ = \(.*\)\n", re.MULTILINE)
+SOURCE_DIR = os.path.join("build", "mypyc-src")
+
+with open("desmoke.py") as file:
+    source, count = SLOTS_LINE.subn("", file.read())
+if count == 0:
+    raise RuntimeError("no __slots__ found in desmoke.py, check SLOTS_LINE in setup.py")
+os.makedirs(SOURCE_DIR, exist_ok=True)
+with open(os.path.join(SOURCE_DIR, "desmoke.py"), "w") as file:
+    file.write(source)
+
+setup(
+    name="desmoke",
+    py_modules=["desmoke"],
+    ext_modules=mypycify([os.path.join(SOURCE_DIR, "desmoke.py")]),
+)